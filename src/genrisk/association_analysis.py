@@ -1,13 +1,53 @@
-import multiprocessing
-import re
-from functools import partial
-
 import numpy as np
 import pandas as pd
 import statsmodels.api as sm
 import scipy.stats as stats
-from scipy.stats import pearsonr
-from tqdm import tqdm
+from scipy.linalg import cho_factor, cho_solve
+
+from .helpers import read_scores_file
+
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True, parallel=True)
+    def _mwu_kernel(pooled_t, n1):
+        """
+        Rank every gene row of the pooled (genes x samples) matrix and return
+        the Mann-Whitney U statistics and tie-correction sums.
+
+        :param pooled_t: the pooled case/control scores, one contiguous row per gene.
+        :param n1: the number of cases (first n1 entries of each row).
+
+        :return: the U statistics and tie sums arrays.
+        """
+        n_genes, n = pooled_t.shape
+        u_statistic = np.empty(n_genes, dtype=np.float64)
+        tie_sum = np.zeros(n_genes, dtype=np.float64)
+        for j in numba.prange(n_genes):
+            row = pooled_t[j]
+            order = np.argsort(row, kind='mergesort')
+            ranks = np.empty(n, dtype=np.float64)
+            i = 0
+            while i < n:
+                k = i
+                while k + 1 < n and row[order[k + 1]] == row[order[i]]:
+                    k += 1
+                avg_rank = 0.5 * (i + k) + 1.0
+                for m in range(i, k + 1):
+                    ranks[order[m]] = avg_rank
+                ties = k - i + 1
+                if ties > 1:
+                    tie_sum[j] += ties ** 3 - ties
+                i = k + 1
+            rank_sum = 0.0
+            for m in range(n1):
+                rank_sum += ranks[m]
+            u_statistic[j] = rank_sum - n1 * (n1 + 1) / 2.0
+        return u_statistic, tie_sum
 
 
 def calc_corr(
@@ -27,109 +67,114 @@ def calc_corr(
 
     :return:
     """
+    # strip surrounding quotes so quoted headers still match the samples column
     with open(first_file) as f:
-        genes_01 = re.split('\s+', f.readline().strip('\n'))
+        genes_01 = [col.strip('"') for col in f.readline().split()]
         genes_01.remove(samples_col)
     with open(second_file) as f:
-        genes_02 = re.split('\s+', f.readline().strip('\n'))
+        genes_02 = [col.strip('"') for col in f.readline().split()]
         genes_02.remove(samples_col)
-    as_set = set(genes_01)
-    common_genes = as_set.intersection(genes_02)
-    genes = list(common_genes)
-    corr_info = []
-    first_df = pd.read_csv(first_file, sep='\t', index_col=False)
-    second_df = pd.read_csv(second_file, sep='\t', index_col=False)
-    for gene in tqdm(genes, desc='calculating correlation'):
-        gene_df = pd.merge(first_df[[samples_col, gene]], second_df[[samples_col, gene]], on=samples_col)
-        gene_df.replace([np.inf, -np.inf, np.nan], 0.0, inplace=True)
-        corr, pval = pearsonr(gene_df[gene + '_x'], gene_df[gene + '_y'])
-        corr_info.append([gene, corr, pval])
-    corr_df = pd.DataFrame(corr_info, columns=['genes', 'corr', 'p_value']).sort_values(by=['p_value'])
+    as_set = set(genes_02)
+    genes = [gene for gene in genes_01 if gene in as_set]
+    first_df = read_scores_file(first_file, samples_col=samples_col, columns=[samples_col] + genes)
+    second_df = read_scores_file(second_file, samples_col=samples_col, columns=[samples_col] + genes)
+    first_df = first_df.set_index(samples_col).sort_index().loc[:, genes]
+    second_df = second_df.set_index(samples_col).sort_index().loc[:, genes]
+    first_df, second_df = first_df.align(second_df, join='inner', axis=0)
+    first_arr = first_df.to_numpy(dtype=np.float32)
+    second_arr = second_df.to_numpy(dtype=np.float32)
+    np.nan_to_num(first_arr, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    np.nan_to_num(second_arr, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    n = first_arr.shape[0]
+    first_arr -= first_arr.mean(axis=0)
+    second_arr -= second_arr.mean(axis=0)
+    num = np.einsum('ij,ij->j', first_arr, second_arr)
+    den = np.sqrt(np.einsum('ij,ij->j', first_arr, first_arr) * np.einsum('ij,ij->j', second_arr, second_arr))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = num / den
+        t_stat = corr * np.sqrt((n - 2) / (1.0 - corr * corr))
+    pvals = 2 * stats.t.sf(np.abs(t_stat), n - 2)
+    order = np.argsort(pvals, kind='stable')
+    corr_df = pd.DataFrame({'genes': np.asarray(genes)[order], 'corr': corr[order], 'p_value': pvals[order]})
     corr_df.to_csv(output_file, sep='\t', index=False)
     return corr_df
 
 
-def run_linear(gene_col, x_set, y_set):
+def _case_control_matrices(df, genes, cases_column, cases, controls):
     """
-    Helper function to run linear regression association.
+    Split the scores into case and control float32 matrices with one boolean mask pass.
 
-    :param gene_col: a tuple from df.iteritems()
-    :param x_set: the covariates.
-    :param y_set: the target.
+    :param df: the merged scores/phenotype dataframe.
+    :param genes: the gene columns to extract.
+    :param cases_column: the column with the case/control categories.
+    :param cases: the name of the cases category, if given.
+    :param controls: the name of the controls category, if given.
 
-    :return: a list with gene name, pvalues, coefs and std err.
+    :return: the cases matrix and the controls matrix (samples x genes).
     """
-    x_set[gene_col[0]] = gene_col[1]
-    x_set = sm.add_constant(x_set)
-    linear_model = sm.OLS(y_set, x_set)
-    result = linear_model.fit()
-    pval = list(result.pvalues)
-    beta_coef = list(result.params)[-1]
-    std_err = result.bse[-1]
-    return [gene_col[0]] + pval + [beta_coef, std_err]
+    if cases and controls:
+        cc = [cases, controls]
+    else:
+        cc = sorted(df[cases_column].unique())
+    if len(cc) > 2:
+        Warning('There are more than two categories here. We will only consider the first two categories.')
+    cases_mask = (df[cases_column] == cc[0]).to_numpy()
+    controls_mask = (df[cases_column] == cc[1]).to_numpy()
+    case_mat = np.ascontiguousarray(df.loc[cases_mask, genes].to_numpy(dtype=np.float32))
+    ctrl_mat = np.ascontiguousarray(df.loc[controls_mask, genes].to_numpy(dtype=np.float32))
+    return case_mat, ctrl_mat
 
 
-def run_logit(gene_col, x_set, y_set):
+def _mannwhitneyu_vectorized(case_mat, ctrl_mat):
     """
-    Helper function to run logistic regression association.
+    Calculate Mann-Whitney U and one-sided (greater) p-values for all gene columns at once.
 
-    :param gene_col: a tuple from df.iteritems()
-    :param x_set: the covariates.
-    :param y_set: the target.
+    The pooled case/control matrix is ranked with a single rankdata call, then
+    the tie-corrected normal approximation (with continuity correction) gives
+    the p-values, mirroring scipy's asymptotic method.
 
-    :return: a list with gene name, pvalues, and std err.
+    :param case_mat: the cases scores matrix (samples x genes).
+    :param ctrl_mat: the controls scores matrix (samples x genes).
+
+    :return: the U statistics and p-values arrays.
     """
-    x_set[gene_col[0]] = gene_col[1]
-    x_set = sm.add_constant(x_set)
-    logit_model = sm.Logit(y_set, x_set)
-    result = logit_model.fit()
-    pval = list(result.pvalues)
-    std_err = result.bse[-1]
-    return [gene_col[0]] + pval + [std_err]
+    n1 = case_mat.shape[0]
+    n2 = ctrl_mat.shape[0]
+    n = n1 + n2
+    pooled = np.vstack([case_mat, ctrl_mat])
+    if NUMBA_AVAILABLE:
+        u_statistic, tie_sum = _mwu_kernel(np.ascontiguousarray(pooled.T), n1)
+    else:
+        ranks = stats.rankdata(pooled, axis=0)
+        u_statistic = ranks[:n1].sum(axis=0) - n1 * (n1 + 1) / 2.0
+        tie_sum = np.zeros(pooled.shape[1], dtype=np.float64)
+        sorted_pooled = np.sort(pooled, axis=0)
+        has_ties = (sorted_pooled[1:] == sorted_pooled[:-1]).any(axis=0)
+        for col in np.flatnonzero(has_ties):
+            _, counts = np.unique(sorted_pooled[:, col], return_counts=True)
+            tie_sum[col] = (counts ** 3 - counts).sum()
+    sd = np.sqrt(n1 * n2 / 12.0 * ((n + 1) - tie_sum / (n * (n - 1))))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (u_statistic - n1 * n2 / 2.0 - 0.5) / sd
+    p_val = stats.norm.sf(z)
+    return u_statistic, p_val
 
 
 def run_mannwhitneyu(*, df, genes, cases_column, **kwargs):
-    p_values = []
-    df_by_cases = df.groupby(cases_column)
-    if kwargs['cases'] and kwargs['controls']:
-        cc = [kwargs['cases'], kwargs['controls']]
-    else:
-        cc = list(df_by_cases.groups.keys())
-    if len(cc) > 2:
-        Warning('There are more than two categories here. We will only consider the first two categories.')
-    for gene in tqdm(genes, desc='Calculating p_values for genes'):
-        case_0 = df_by_cases.get_group(cc[0])[gene].tolist()
-        case_1 = df_by_cases.get_group(cc[1])[gene].tolist()
-        try:
-            u_statistic, p_val = stats.mannwhitneyu(case_0, case_1, alternative='greater')
-        except:
-            continue
-        p_values.append([gene, u_statistic, p_val])
-    cols = ['genes', 'statistic', 'p_value']
-    p_values_df = pd.DataFrame(p_values, columns=cols).sort_values(by=['p_value'])
+    case_mat, ctrl_mat = _case_control_matrices(df, genes, cases_column, kwargs['cases'], kwargs['controls'])
+    u_statistic, p_val = _mannwhitneyu_vectorized(case_mat, ctrl_mat)
+    order = np.argsort(p_val, kind='stable')
+    p_values_df = pd.DataFrame(
+        {'genes': np.asarray(genes)[order], 'statistic': u_statistic[order], 'p_value': p_val[order]})
     return p_values_df
 
 
 def run_ttest(*, df, genes, cases_column, **kwargs):
-    p_values = []
-    df_by_cases = df.groupby(cases_column)
-    if kwargs['cases'] and kwargs['controls']:
-        cc = [kwargs['cases'], kwargs['controls']]
-    else:
-        cc = list(df_by_cases.groups.keys())
-    if len(cc) > 2:
-        Warning('There are more than two categories here. We will only consider the first two categories.')
-
-    for gene in tqdm(genes, desc='Calculating p_values for genes'):
-        case_0 = df_by_cases.get_group(cc[0])[gene].tolist()
-        case_1 = df_by_cases.get_group(cc[1])[gene].tolist()
-        try:
-            statistic, p_val = stats.ttest_ind(case_0, case_1)
-        except:
-            continue
-        p_values.append([gene, statistic, p_val])
-    cols = ['genes', 'statistic', 'p_value']
-    p_values_df = pd.DataFrame(p_values, columns=cols).sort_values(by=['p_value'])
+    case_mat, ctrl_mat = _case_control_matrices(df, genes, cases_column, kwargs['cases'], kwargs['controls'])
+    statistic, p_val = stats.ttest_ind(case_mat, ctrl_mat, axis=0)
+    order = np.argsort(p_val, kind='stable')
+    p_values_df = pd.DataFrame(
+        {'genes': np.asarray(genes)[order], 'statistic': statistic[order], 'p_value': p_val[order]})
     return p_values_df
 
 
@@ -137,25 +182,60 @@ def get_pvals_logit(*, df, genes, cases_column, **kwargs):
     covariates = kwargs['covariates']
     df[cases_column] = np.interp(
         df[cases_column], (df[cases_column].min(), df[cases_column].max()), (0, 1))
-    y_set = df[[cases_column]]
-    x_set = df[covariates]
-    genes_df = df[genes]
-    pool = multiprocessing.Pool(processes=kwargs['processes'])
-    partial_func = partial(run_logit, x_set=x_set, y_set=y_set)
-    p_values = list(pool.imap(partial_func, genes_df.iteritems()))
-    cols = ['genes', 'const_pval'] + covariates + ['p_value', 'std_err']
-    p_values_df = pd.DataFrame(p_values, columns=cols).sort_values(by=['p_value'])
+    y_set = df[cases_column].to_numpy(dtype=np.float64)
+    x_base = np.column_stack([np.ones(df.shape[0]), df[covariates].to_numpy(dtype=np.float64)])
+    # the wide gene matrix stays float32; only the small covariate-sized
+    # factors are kept in float64.
+    genes_arr = df[genes].to_numpy(dtype=np.float32)
+    # fit the covariate-only null model once; the per-gene score (Rao) tests
+    # then reduce to matrix products against the null residuals.
+    null_result = sm.Logit(y_set, x_base).fit(disp=0)
+    prob = null_result.predict(x_base)
+    resid = (y_set - prob).astype(np.float32)
+    weights = prob * (1.0 - prob)
+    weights32 = weights.astype(np.float32)
+    x_base32 = x_base.astype(np.float32)
+    info_chol = cho_factor(x_base.T @ (weights[:, None] * x_base))
+    weighted_genes = weights32[:, None] * genes_arr
+    resid_genes = genes_arr - x_base32 @ cho_solve(info_chol, x_base.T @ weighted_genes).astype(np.float32)
+    score = resid_genes.T @ resid
+    variance = np.einsum('ij,ij->j', weights32[:, None] * resid_genes, resid_genes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = score ** 2 / variance
+    p_val = stats.chi2.sf(chi2, 1)
+    order = np.argsort(p_val, kind='stable')
+    p_values_df = pd.DataFrame(
+        {'genes': np.asarray(genes)[order], 'statistic': chi2[order], 'p_value': p_val[order]})
     return p_values_df
 
 
 def get_pvals_linear(*, df, genes, cases_column, **kwargs):
     covariates = kwargs.get('covariates')
-    y_set = df[[cases_column]]
-    x_set = df[covariates]
-    genes_df = df[genes]
-    pool = multiprocessing.Pool(processes=kwargs['processes'])
-    partial_func = partial(run_linear, x_set=x_set, y_set=y_set)
-    p_values = list(pool.imap(partial_func, genes_df.iteritems()))
-    cols = ['genes', 'const_pval'] + covariates + ['p_value', 'beta_coef', 'std_err']
-    p_values_df = pd.DataFrame(p_values, columns=cols).sort_values(by=['p_value'])
+    y_set = df[cases_column].to_numpy(dtype=np.float64)
+    x_base = np.column_stack([np.ones(df.shape[0]), df[covariates].to_numpy(dtype=np.float64)])
+    # the wide gene matrix stays float32; only the small covariate-sized
+    # factors are kept in float64.
+    genes_arr = df[genes].to_numpy(dtype=np.float32)
+    n, k = x_base.shape
+    # residualize the target and every gene column against the covariate design,
+    # then the per-gene OLS coefficient and t-statistic follow in closed form.
+    # The Gram matrix is factored once and its Cholesky reused for every solve.
+    gram_chol = cho_factor(x_base.T @ x_base)
+    beta_base = cho_solve(gram_chol, x_base.T @ y_set)
+    resid_y = (y_set - x_base @ beta_base).astype(np.float32)
+    x_base32 = x_base.astype(np.float32)
+    resid_genes = genes_arr - x_base32 @ cho_solve(gram_chol, x_base.T @ genes_arr).astype(np.float32)
+    num = resid_genes.T @ resid_y
+    den = np.einsum('ij,ij->j', resid_genes, resid_genes)
+    dof = n - k - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        beta_coef = (num / den).astype(np.float32)
+        sigma2 = ((resid_y[:, None] - resid_genes * beta_coef) ** 2).sum(axis=0, dtype=np.float64) / dof
+        std_err = np.sqrt(sigma2 / den)
+        t_stat = beta_coef / std_err
+    p_val = 2 * stats.t.sf(np.abs(t_stat), dof)
+    order = np.argsort(p_val, kind='stable')
+    p_values_df = pd.DataFrame(
+        {'genes': np.asarray(genes)[order], 'p_value': p_val[order],
+         'beta_coef': beta_coef[order], 'std_err': std_err[order]})
     return p_values_df
@@ -1,20 +1,25 @@
 # -*- coding: utf-8 -*-
+import gzip
+import itertools
 import os
-import shutil
 import subprocess
 
 import click
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 
-from genrisk.gene_scoring import download_pgs
-from genrisk.helpers import create_logger
+from genrisk.gene_scoring import download_pgs, prewarm_weight_kernel
+from genrisk.helpers import create_logger, fast_rmtree, read_table
 from .pipeline import find_pvalue, betareg_pvalues, create_prediction_model, model_testing, scoring_process
 from .utils import draw_qqplot, draw_manhattan
 
 
 log = click.option('--log', is_flag=True, help="create a log file for the command")
 
+if os.environ.get('GENRISK_PREWARM', '1') == '1':
+    prewarm_weight_kernel()
+
 
 @click.group()
 def main():
@@ -25,7 +30,9 @@ def main():
 @click.option('-a', '--annotated-vcf', required=True, type=click.Path(exists=True), help='the annotated vcf')
 @click.option('-b', '--bfiles', default=None)
 @click.option('--plink', default='plink', help="the directory of plink, if not set in environment")
-@click.option('-t', '--temp-dir', required=True, help="a temporary directory to save temporary files before merging.")
+@click.option('-t', '--temp-dir', required=True,
+              help="a temporary directory to save temporary files before merging. "
+                   "A tmpfs mount (e.g. /dev/shm) speeds up the per-gene file churn.")
 @click.option('-o', '--output-file', required=True, help="the final output scores matrix.")
 @click.option('-p', '--beta-param', default=(1.0, 25.0), nargs=2, type=float,
               help="the parameters from beta weight function.")
@@ -37,6 +44,8 @@ def main():
 @click.option('-d', '--del-col', default='CADD_raw', help="the column containing the deleteriousness score.")
 @click.option('-l', '--alt-col', default='Alt', help="the column containing the alternate base.")
 @click.option('-m', '--maf-threshold', default=0.01, help="the threshold for minor allele frequency.")
+@click.option('-j', '--jobs', default=None, type=int,
+              help="the number of plink processes to run concurrently, defaults to the cpu count.")
 @log
 def score_genes(
     *,
@@ -53,6 +62,7 @@ def score_genes(
     del_col,
     alt_col,
     maf_threshold,
+    jobs,
     log,
 ):
     """
@@ -72,6 +82,7 @@ def score_genes(
     :param del_col: the column containing deleteriousness score.
     :param alt_col: the column containing alternate base.
     :param maf_threshold: the threshold for minor allele frequency.
+    :param jobs: the number of plink processes to run concurrently.
 
     :return: the final dataframe information.
     """
@@ -99,10 +110,11 @@ def score_genes(
         del_col=del_col,
         alt_col=alt_col,
         maf_threshold=maf_threshold,
+        jobs=jobs,
     )
     if confirm:
         logger.info('The temporary files will be removed now.')
-        shutil.rmtree(temp_dir)
+        fast_rmtree(temp_dir)
     return df.info()
 
 
@@ -125,6 +137,10 @@ def score_genes(
      'simes-hochberg', 'hommel', 'fdr_bh', 'fdr_by', 'fdr_tsbh', 'fdr_tsbky']))
 @click.option('-v', '--covariates', default='PC1,PC2', help="the covariates used for calculation")
 @click.option('-p', '--processes', type=int, default=1, help='number of processes for parallelization')
+@click.option('--cache', is_flag=True,
+              help='keep a parquet copy of the scores file to speed up repeated runs.')
+@click.option('--backend', default='pandas', type=click.Choice(['pandas', 'polars']),
+              help='the dataframe backend used to read and merge the input files.')
 @log
 def find_association(
     *,
@@ -138,6 +154,8 @@ def find_association(
     adj_pval,
     covariates,
     processes,
+    cache,
+    backend,
     log
 ):
     """
@@ -154,6 +172,8 @@ def find_association(
     :param adj_pval: the adjustment method used (if any).
     :param covariates: the column names of covariates to use, with comma in between. (e.g: PC1,PC2,age)
     :param processes: number of processes for parallelization.
+    :param cache: if True, keep a parquet copy of the scores file for faster re-runs.
+    :param backend: the dataframe backend used to read and merge the input files (pandas or polars).
 
     :return:
     """
@@ -187,6 +207,8 @@ def find_association(
             adj_pval=adj_pval,
             covariates=covariates,
             processes=processes,
+            cache=cache,
+            backend=backend,
             logger=logger
         )
         return df.info()
@@ -238,7 +260,7 @@ def visualize(
     logger = create_logger(name='Visualization', filename=filename)
     logger.info(locals())
     logger.info('Reading p_values file...')
-    pvals_df = pd.read_csv(pvals_file, sep='\t', index_col=False)
+    pvals_df = read_table(pvals_file, index_col=False, dtype={pval_col: np.float32})
     if qq_output:
         logger.info('Creating QQ-plot...')
         try:
@@ -250,8 +272,10 @@ def visualize(
         logger.info('Creating Manhattan plot...')
         if not info_file:
             logger.exception('Please provide a file with gene information to generate manhattan plot.')
-        info_df = pd.read_csv(info_file, sep="\t", index_col=False)
-        merged = pd.merge(pvals_df, info_df, left_on=genescol_1, right_on=genescol_2, how='inner')
+        info_df = read_table(info_file, index_col=False)
+        info_df[genescol_2] = info_df[genescol_2].astype('category')
+        pvals_df[genescol_1] = pvals_df[genescol_1].astype(info_df[genescol_2].dtype)
+        merged = pvals_df.join(info_df.set_index(genescol_2), on=genescol_1, how='inner')
         try:
             draw_manhattan(
                 data=merged,
@@ -282,6 +306,7 @@ def visualize(
 @click.option('-f', '--folds', default=10, type=int, help='number of cross-validation folds in training.')
 @click.option('--metric', help='the metric used to choose best model after training.')
 @click.option('-s', '--samples-col', default='IID')
+@click.option('--plots', is_flag=True, help='if flagged the evaluation plots will be saved with the model.')
 def create_model(
     *,
     data_file,
@@ -296,6 +321,7 @@ def create_model(
     folds,
     metric,
     samples_col,
+    plots,
 ):
     """
     Create a machine learning model with given dataset.
@@ -313,10 +339,11 @@ def create_model(
     :param normalize:  if true the data will be normalized before training
     :param folds: the number of folds used for cross validation
     :param metric: the metric used to choose best model after training.
+    :param plots: if true the evaluation plots will be saved with the model.
 
     :return: the final model
     """
-    training_set = pd.read_csv(data_file, sep='\t', index_col=samples_col)
+    training_set = read_table(data_file, index_col=samples_col)
     testing_set = pd.DataFrame()
     if test:
         training_set, testing_set = train_test_split(training_set, test_size=test_size)
@@ -333,6 +360,7 @@ def create_model(
         training_set=training_set,
         testing_set=testing_set,
         test_size=test_size,
+        plots=plots,
     )
     return model
 
@@ -397,9 +425,12 @@ def get_prs(
     if download:
         pgs_id = click.prompt('Please input PGS ID', type=str)
         pgs_file = download_pgs(prs_id=pgs_id)
-        p = subprocess.run(["zcat", pgs_file, "|", 'head', '-n', "15"], shell=True)
-        if p.returncode != 0:
-            click.echo('The PGS file could not be viewed using cmd, please view it manually.')
+        try:
+            with gzip.open(pgs_file, 'rt') as f:
+                for line in itertools.islice(f, 15):
+                    click.echo(line.rstrip('\n'))
+        except OSError:
+            click.echo('The PGS file could not be viewed, please view it manually.')
         click.echo('Please check the PGS file viewed and provide us with the needed columns.')
     else:
         pgs_file = click.prompt('Please provide path to PGS file', type=str)
@@ -415,12 +446,12 @@ def get_prs(
         return 'Ok. You still have the PGS file (if downloaded) but the scores were not calculated.'
     output_file = click.prompt('Please provide an output file path', type=str)
     if file_type == 'vcf':
-        p = subprocess.call(
+        subprocess.call(
             plink + " --vcf " + input_file + " --score " + pgs_file + " " + cols + " sum --out " + output_file,
             shell=True
         )
     else:
-        p = subprocess.call(
+        subprocess.call(
             plink + " --bfile " + input_file + " --score " + pgs_file + " " + cols + " sum --out " + output_file,
             shell=True
         )
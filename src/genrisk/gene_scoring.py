@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import gzip
+import math
 import os
-import re
-import subprocess
 import urllib.request as urllib
+from pathlib import Path
 
 import numpy as np
 import pandas as pd
@@ -11,7 +12,57 @@ import requests
 from scipy.stats import beta
 from tqdm import tqdm
 
-from .helpers import uni_profiles
+try:
+    import numba
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    from pyarrow import feather
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    @numba.njit(cache=True, fastmath=True, parallel=True)
+    def apply_weights(af, beta_a, beta_b, mode):
+        """
+        Calculate the variant weights (beta pdf if mode is 0, else -log10) in a compiled parallel loop.
+
+        :param af: the allele frequencies as a contiguous float32 array.
+        :param beta_a: the first parameter of the beta function.
+        :param beta_b: the second parameter of the beta function.
+        :param mode: 0 for beta weighting, 1 for log10 weighting.
+
+        :return: the weights array.
+        """
+        weights = np.empty(af.shape[0], dtype=np.float32)
+        beta_const = math.exp(math.lgamma(beta_a) + math.lgamma(beta_b) - math.lgamma(beta_a + beta_b))
+        for i in numba.prange(af.shape[0]):
+            if mode == 0:
+                weights[i] = (af[i] ** (beta_a - 1.0)) * ((1.0 - af[i]) ** (beta_b - 1.0)) / beta_const
+            elif af[i] > 0.0:
+                weights[i] = -math.log10(af[i])
+            else:
+                weights[i] = 0.0
+        return weights
+
+
+def prewarm_weight_kernel():
+    """
+    Compile the numba weight kernel before the first real call.
+
+    With cache=True the compiled kernel is persisted on disk, so the warmup
+    pays the LLVM compile cost only once per environment instead of on every
+    scoring run.
+
+    :return:
+    """
+    if NUMBA_AVAILABLE:
+        apply_weights(np.zeros(1, dtype=np.float32), 1.0, 25.0, 0)
 
 
 def get_gene_info(
@@ -54,7 +105,21 @@ def get_gene_info(
             for line in file:
                 if line.startswith('##'):
                     skip += 1
-    df = pd.read_csv(annotated_vcf, usecols=[variant_col, alt_col, 'INFO'], skiprows=skip, sep=r'\s+', index_col=False)
+    df = None
+    if PYARROW_AVAILABLE:
+        try:
+            table = pa_csv.read_csv(
+                annotated_vcf,
+                read_options=pa_csv.ReadOptions(skip_rows=skip, block_size=64 << 20),
+                parse_options=pa_csv.ParseOptions(delimiter='\t'),
+                convert_options=pa_csv.ConvertOptions(include_columns=[variant_col, alt_col, 'INFO']),
+            )
+            df = table.to_pandas(self_destruct=True)
+        except (pa.ArrowInvalid, KeyError):
+            df = None
+    if df is None:
+        df = pd.read_csv(
+            annotated_vcf, usecols=[variant_col, alt_col, 'INFO'], skiprows=skip, sep=r'\s+', index_col=False)
     info = df['INFO'].str.split(pat=';', expand=True)
     missing_info = info[info.isnull().any(axis=1)].index
     df.drop(missing_info, inplace=True)
@@ -70,23 +135,28 @@ def get_gene_info(
     df = pd.concat([df, info], axis=1)
     df = df[df[af_col].values.astype(float) < maf_threshold]
     df.replace('.', 0.0, inplace=True)
-    if weight_func == 'beta':
+    if NUMBA_AVAILABLE:
+        af_values = np.ascontiguousarray(df[af_col].values.astype(np.float32))
+        df[weight_func] = apply_weights(af_values, beta_param[0], beta_param[1], 0 if weight_func == 'beta' else 1)
+    elif weight_func == 'beta':
         df[weight_func] = beta.pdf(df[af_col].values.astype(float), beta_param[0], beta_param[1])
     elif weight_func == 'log10':
         df[weight_func] = -np.log10(df[af_col].values.astype(float))
         df[weight_func].replace([np.inf, -np.inf, np.nan], 0.0, inplace=True)
     df['score'] = df[weight_func].values.astype(float) * df[del_col].values.astype(float)
-    genes = list(set(df[genes_col]))
+    gene_groups = df.groupby(genes_col, sort=False)
+    genes = list(gene_groups.groups.keys())
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
     gene_file = output_dir + '.genes'
     with open(os.path.join(output_dir, gene_file), 'w') as f:
         f.writelines("%s\n" % gene for gene in genes)
-    [df[df[genes_col] == gene][[variant_col, alt_col, 'score', genes_col]].to_csv(os.path.join(output_dir, (
-        str(gene) + '.w')), index=False, sep='\t') for gene in tqdm(genes, desc="writing w gene files")]
-    [df[df[genes_col] == gene][[variant_col, alt_col]].to_csv(os.path.join(output_dir, (str(gene) + '.v')),
-                                                              index=False, sep='\t') for gene in
-     tqdm(genes, desc="writing v gene files")]
+    miniters = max(1, len(genes) // 100)
+    for gene, gene_df in tqdm(gene_groups, desc="writing gene files", mininterval=1.0, miniters=miniters):
+        gene_df[[variant_col, alt_col, 'score', genes_col]].to_csv(
+            os.path.join(output_dir, (str(gene) + '.w')), index=False, sep='\t')
+        gene_df[[variant_col, alt_col]].to_csv(
+            os.path.join(output_dir, (str(gene) + '.v')), index=False, sep='\t')
     return output_dir
 
 
@@ -104,25 +174,90 @@ def combine_scores(
     :return: dataframe with all the scores.
     """
     all_files = [os.path.join(path, name) for path, subdirs, files in os.walk(input_path) for name in files]
-    profile_files = [f for f in all_files if re.match(r'.+profile$', f)]
-    df = pd.read_csv(str(profile_files[0]), usecols=['IID', 'SCORESUM'], sep=r'\s+').astype({'SCORESUM': np.float32})
-    r = re.compile("([a-zA-Z0-9_.-]*).profile$")
-    gene = r.findall(str(profile_files[0]))
-    df.rename(columns={'SCORESUM': gene[0]}, inplace=True)
-    pf = profile_files
-    for i in tqdm(range(1, len(pf) - 1), desc='merging in process'):
-        df = uni_profiles(df, pf[i])
+    feather_files = [f for f in all_files if f.endswith('.feather')]
+    if PYARROW_AVAILABLE and feather_files:
+        frames = [feather.read_feather(f).set_index('IID')
+                  for f in tqdm(feather_files, desc='merging in process', mininterval=1.0,
+                                miniters=max(1, len(feather_files) // 100))]
+        df = pd.concat(frames, axis=1, join='inner').reset_index()
+    else:
+        profile_files = [f for f in all_files if f.endswith('.profile')]
+        gene_names = [Path(f).stem for f in profile_files]
+        first = pd.read_csv(str(profile_files[0]), usecols=['IID', 'SCORESUM'], delim_whitespace=True,
+                            engine='c', memory_map=True, dtype={'IID': str, 'SCORESUM': np.float32})
+        iid_index = pd.Index(first['IID'])
+        scores = np.empty((len(iid_index), len(profile_files)), dtype=np.float32)
+        scores[:, 0] = first['SCORESUM'].to_numpy(dtype=np.float32)
+        for i in tqdm(range(1, len(profile_files)), desc='merging in process', mininterval=1.0,
+                      miniters=max(1, len(profile_files) // 100)):
+            profile = pd.read_csv(str(profile_files[i]), usecols=['IID', 'SCORESUM'], delim_whitespace=True,
+                                  engine='c', memory_map=True, dtype={'IID': str, 'SCORESUM': np.float32})
+            scores[:, i] = profile.set_index('IID')['SCORESUM'].reindex(iid_index).to_numpy(dtype=np.float32)
+        df = pd.DataFrame(scores, columns=gene_names)
+        df.insert(0, 'IID', iid_index)
+    # write with pandas: pyarrow's csv writer quotes the header row even with
+    # quoting_style='none', which breaks the header probes downstream.
     df.to_csv(output_path, sep='\t', index=False)
     return df
 
 
-def plink_process(*, genes_folder, plink, annotated_vcf, bfiles=None):
+def _profile_to_feather(profile_file):
+    """
+    Convert one plink profile into a feather file holding the IID and gene score columns.
+
+    :param profile_file: the path to the plink profile.
+
+    :return:
+    """
+    if not os.path.isfile(profile_file):
+        return
+    df = pd.read_csv(profile_file, usecols=['IID', 'SCORESUM'], delim_whitespace=True, engine='c',
+                     memory_map=True, dtype={'IID': str, 'SCORESUM': np.float32})
+    df.rename(columns={'SCORESUM': Path(profile_file).stem}, inplace=True)
+    feather.write_feather(df, profile_file[:-len('.profile')] + '.feather', compression='lz4')
+
+
+async def _plink_gene(*, semaphore, plink, input_files, genes_folder, gene):
+    """
+    Run plink for one gene, bounded by the shared semaphore.
+
+    :param semaphore: a semaphore limiting the number of concurrent plink processes.
+    :param plink: the directory of plink (if not default).
+    :param input_files: the plink input argument (vcf or bfiles).
+    :param genes_folder: the folder containing the temporary genes files.
+    :param gene: the gene name.
+
+    :return:
+    """
+    v_file = os.path.join(genes_folder, (gene + '.v'))
+    w_file = os.path.join(genes_folder, (gene + '.w'))
+    async with semaphore:
+        p = await asyncio.create_subprocess_shell(
+            plink + input_files + " --double-id" + " --extract " + v_file + " --score " + w_file +
+            " 1 2 3 sum --out " + os.path.join(genes_folder, gene),
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        await p.communicate()
+        if PYARROW_AVAILABLE:
+            await asyncio.to_thread(_profile_to_feather, os.path.join(genes_folder, gene + '.profile'))
+
+
+async def _plink_all(*, genes, plink, input_files, genes_folder, jobs):
+    semaphore = asyncio.Semaphore(jobs)
+    await asyncio.gather(*(
+        _plink_gene(semaphore=semaphore, plink=plink, input_files=input_files, genes_folder=genes_folder, gene=gene)
+        for gene in genes))
+
+
+def plink_process(*, genes_folder, plink, annotated_vcf, bfiles=None, jobs=None):
     """
     Use plink to calculate and sum the scores for each gene.
 
     :param genes_folder: the folder containing the temporary genes files.
     :param plink: the directory of plink (if not default).
     :param annotated_vcf: vcf with samples information
+    :param jobs: the number of plink processes to run concurrently. Defaults to the cpu count.
 
     :return:
     """
@@ -131,13 +266,10 @@ def plink_process(*, genes_folder, plink, annotated_vcf, bfiles=None):
         input_files = " --bfile " + bfiles
     else:
         input_files = " --vcf " + annotated_vcf
-    for gene in tqdm(genes, desc='calculating genes scores'):
-        v_file = os.path.join(genes_folder, (gene + '.v'))
-        w_file = os.path.join(genes_folder, (gene + '.w'))
-        p = subprocess.call(
-            plink + input_files + " --double-id" + " --extract " + v_file + " --score " + w_file +
-            " 1 2 3 sum --out " + os.path.join(genes_folder, gene), shell=True
-        )
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    asyncio.run(
+        _plink_all(genes=genes, plink=plink, input_files=input_files, genes_folder=genes_folder, jobs=jobs))
 
 
 def download_pgs(
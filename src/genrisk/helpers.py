@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import re
+import os
 
 import logging
 import matplotlib.pyplot as plt
@@ -8,24 +9,104 @@ import numpy as np
 import pandas as pd
 import sklearn.metrics as metrics
 
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    from pyarrow import parquet as pa_parquet
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
 
-def uni_profiles(df, f):
+
+def read_scores_file(scores_file, samples_col=None, columns=None, cache=False):
     """
-    Merge two dataframes.
+    Read a scores matrix with the fastest available csv parser.
 
-    :param df: the main dataframe with all the scores.
-    :param f: the file containing the scores of one gene.
+    :param scores_file: the path to the scores file.
+    :param samples_col: the column containing the samples IDs, kept as string.
+    :param columns: an optional list of columns to read. If None all columns are read.
+    :param cache: if True, keep a parquet copy next to the file and reuse it on later reads.
 
-    :return: the merged dataframe.
+    :return: the scores dataframe.
     """
-    df2 = pd.read_csv(str(f), usecols=['IID', 'SCORESUM'], sep=r'\s+').astype({'SCORESUM': np.float32})
-    r = re.compile("([a-zA-Z0-9_.-]*).profile$")
-    gene2 = r.findall(str(f))
-    df2.rename(columns={'SCORESUM': gene2[0]}, inplace=True)
-    df = pd.merge(df, df2, on='IID')
+    cache_file = scores_file + '.parquet'
+    if cache and PYARROW_AVAILABLE and os.path.isfile(cache_file) \
+            and os.path.getmtime(cache_file) >= os.path.getmtime(scores_file):
+        return pa_parquet.read_table(cache_file, columns=columns).to_pandas(self_destruct=True)
+    header = None
+    if samples_col:
+        with open(scores_file) as f:
+            # strip surrounding quotes so the dtype maps below match the
+            # names the parsers produce for quoted headers.
+            header = [col.strip('"') for col in f.readline().split()]
+    df = None
+    if PYARROW_AVAILABLE:
+        try:
+            column_types = None
+            if header:
+                column_types = {col: (pa.string() if col == samples_col else pa.float32()) for col in header}
+            table = pa_csv.read_csv(
+                scores_file,
+                parse_options=pa_csv.ParseOptions(delimiter='\t'),
+                convert_options=pa_csv.ConvertOptions(column_types=column_types, include_columns=columns),
+            )
+            df = table.to_pandas(self_destruct=True)
+        except pa.ArrowInvalid:
+            pass
+    if df is None:
+        dtype = None
+        if header:
+            dtype = {col: (str if col == samples_col else np.float32) for col in header}
+        df = pd.read_csv(scores_file, delim_whitespace=True, engine='c', usecols=columns, dtype=dtype)
+    if cache and PYARROW_AVAILABLE and columns is None:
+        pa_parquet.write_table(
+            pa.Table.from_pandas(df, preserve_index=False), cache_file,
+            compression='zstd', compression_level=3, row_group_size=200000)
     return df
 
 
+def read_table(file_path, **kwargs):
+    """
+    Read a tab-separated file, preferring the multithreaded pyarrow csv engine.
+
+    :param file_path: the path to the tab-separated file.
+    :param kwargs: extra keyword arguments forwarded to pandas.read_csv.
+
+    :return: the dataframe.
+    """
+    if PYARROW_AVAILABLE:
+        try:
+            return pd.read_csv(file_path, sep='\t', engine='pyarrow', **kwargs)
+        except (ValueError, pa.ArrowInvalid):
+            # the pyarrow engine rejects some read_csv options and some files;
+            # fall back to the default parser in both cases.
+            pass
+    return pd.read_csv(file_path, sep='\t', **kwargs)
+
+
+def fast_rmtree(path, jobs=16):
+    """
+    Remove a directory tree, unlinking its files from parallel threads.
+
+    The temporary scoring folders hold thousands of small per-gene files;
+    threads overlap the unlink syscalls instead of walking the tree serially.
+
+    :param path: the directory to remove.
+    :param jobs: the number of threads used for unlinking.
+
+    :return:
+    """
+    dirs = []
+    files = []
+    for root, subdirs, names in os.walk(path, topdown=False):
+        dirs.append(root)
+        files.extend(os.path.join(root, name) for name in names)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(os.unlink, files))
+    for directory in dirs:
+        os.rmdir(directory)
+
+
 def generate_scatterplot(*, x_axis, y_axis, output):
     plt.scatter(x_axis, y_axis, alpha=0.5)
     m, b = np.polyfit(x_axis, y_axis, 1)
@@ -45,17 +126,17 @@ def generate_confusion_matrix(x_set, y_set, output):
 
 
 def write_output(*, input_list, output):
-    textfile = open(output, "w")
-    for line in input_list:
-        textfile.write(line)
-    textfile.close()
+    with open(output, "w") as textfile:
+        textfile.write(''.join(input_list))
 
 
 def create_logger(*, name, filename=None):
     logger = logging.getLogger(name)
     logger.setLevel(logging.DEBUG)
     logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    if filename:
+    if filename and not logger.handlers:
+        # emit through our own handlers only, not the root handler as well
+        logger.propagate = False
         now = datetime.now()
         log_file = filename + now.strftime("_%d%m%Y_%H%M") + '.log'
         # create file handler which logs even debug messages
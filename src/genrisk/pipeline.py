@@ -7,9 +7,16 @@ import numpy as np
 import pandas as pd
 from statsmodels.stats.multitest import multipletests
 
+try:
+    import polars as pl
+    POLARS_AVAILABLE = True
+except ImportError:
+    POLARS_AVAILABLE = False
+
 from .prediction_models import regression_model, classification_model, test_classifier, test_regressor
 from .association_analysis import run_mannwhitneyu, run_ttest, get_pvals_logit, get_pvals_linear
 from .gene_scoring import get_gene_info, plink_process, combine_scores
+from .helpers import read_scores_file, read_table
 
 PATH = os.path.abspath(os.path.join((__file__), os.pardir, os.pardir, os.pardir))
 BETAREG_SHELL = os.path.join(PATH, 'scripts', 'betareg_shell.R')
@@ -19,6 +26,26 @@ association_functions = {
     'logit': get_pvals_logit,
     'linear': get_pvals_linear,
 }
+# genes per association block; bounds the temporary matrices the tests build
+# so peak memory stays flat for very wide score files.
+GENE_BLOCK_SIZE = 5000
+
+
+def _bh_adjust(pvals):
+    """
+    Benjamini-Hochberg adjustment of a p-values array with a single argsort.
+
+    :param pvals: the raw p-values.
+
+    :return: the adjusted p-values, in the input order.
+    """
+    n = pvals.size
+    order = np.argsort(pvals)
+    ranked = pvals[order] * n / np.arange(1, n + 1)
+    adjusted = np.minimum.accumulate(ranked[::-1])[::-1]
+    out = np.empty_like(adjusted)
+    out[order] = np.clip(adjusted, 0.0, 1.0)
+    return out
 
 
 def scoring_process(
@@ -36,7 +63,8 @@ def scoring_process(
     alt_col,
     bfiles,
     plink,
-    output_file
+    output_file,
+    jobs=None
 ):
     """
     Calculate gene-based scores.
@@ -56,6 +84,7 @@ def scoring_process(
     :param del_col: the column containing deleteriousness score.
     :param alt_col: the column containing alternate base.
     :param maf_threshold: the threshold for minor allele frequency.
+    :param jobs: the number of plink processes to run concurrently.
 
     :return: gene-based scores dataframe.
     """
@@ -77,7 +106,7 @@ def scoring_process(
         raise
     logger.info('calculating gene scores ...')
     try:
-        plink_process(genes_folder=genes_folder, plink=plink, annotated_vcf=annotated_vcf, bfiles=bfiles)
+        plink_process(genes_folder=genes_folder, plink=plink, annotated_vcf=annotated_vcf, bfiles=bfiles, jobs=jobs)
     except Exception as arg:
         logger.exception(arg)
         raise
@@ -105,6 +134,8 @@ def find_pvalue(
     cases=None,
     controls=None,
     processes=1,
+    cache=False,
+    backend='pandas',
     logger
 ):
     """
@@ -123,40 +154,84 @@ def find_pvalue(
     :param cases:  the name of the cases category.
     :param covariates: the covariates of the phenotype.
     :param processes: number of processes working in parallel.
+    :param cache: if True, keep a parquet copy of the scores file for faster re-runs.
+    :param backend: polars to read and merge the input files with lazy polars frames, pandas otherwise.
     :param logger: an object that logs function outputs.
 
     :return: dataframe with genes and their p_values
     """
-    logger.info("Reading scores file...")
-    scores_df = pd.read_csv(scores_file, sep=r'\s+', index_col=samples_column)
-    scores_df.replace([np.inf, -np.inf], 0, inplace=True)
-    scores_df.fillna(0, inplace=True)
-    scores_df = scores_df.loc[:, scores_df.var() != 0.0].reset_index()
-    logger.info("Reading info file...")
-    genotype_df = pd.read_csv(info_file, sep='\t')
-    genotype_df.dropna(subset=[cases_column], inplace=True)
-    logger.info("Processing files...")
-    merged_df = genotype_df.merge(scores_df, how='inner', on=samples_column)
-    merged_df.replace([np.inf, -np.inf], 0, inplace=True)
-    merged_df.fillna(0, inplace=True)
-    if genes is None:
-        genes = scores_df.columns.tolist()[1:]
-    del scores_df
     if covariates:
         covariates = covariates.split(',')
+    info_cols = [samples_column, cases_column] + (covariates or [])
+    if backend == 'polars' and POLARS_AVAILABLE:
+        logger.info("Reading and merging the files with polars...")
+        # one lazy query covers read, phenotype filtering and the inner join,
+        # so polars can fuse and parallelize the whole scan.
+        scores = pl.scan_csv(scores_file, separator='\t').with_columns(
+            pl.all().exclude(samples_column).cast(pl.Float32))
+        phenotypes = pl.scan_csv(info_file, separator='\t').select(info_cols).drop_nulls(cases_column)
+        merged_df = phenotypes.join(scores, on=samples_column, how='inner').collect().to_pandas()
+        merged_df.set_index(samples_column, inplace=True)
+        if genes is None:
+            genes = [col for col in merged_df.columns if col not in info_cols]
+        gene_values = np.nan_to_num(
+            merged_df[genes].to_numpy(dtype=np.float32), copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        merged_df[genes] = gene_values
+        genes = [gene for gene, keep in zip(genes, gene_values.var(axis=0) != 0.0) if keep]
+        del gene_values
+    else:
+        if backend == 'polars':
+            logger.info("polars is not installed, falling back to pandas.")
+        logger.info("Reading scores file...")
+        scores_df = read_scores_file(scores_file, samples_col=samples_column, cache=cache).set_index(samples_column)
+        # the gene columns form one float32 block, so this scrubs NaN/inf in place
+        # in a single pass instead of copying the frame twice.
+        score_values = scores_df.to_numpy(copy=False)
+        np.nan_to_num(score_values, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+        # drop constant genes with one numpy variance pass over the same block;
+        # the pandas path would recompute column-by-column in float64.
+        scores_df = scores_df.iloc[:, score_values.var(axis=0) != 0.0]
+        logger.info("Reading info file...")
+        # the scores samples column is read as string, so force the same dtype
+        # here or numeric sample IDs would join str-vs-int to an empty frame.
+        genotype_df = read_table(info_file, usecols=info_cols, dtype={samples_column: str})
+        genotype_df.dropna(subset=[cases_column], inplace=True)
+        logger.info("Processing files...")
+        # both frames are aligned on the samples index, so a join avoids the
+        # hash-merge rematerialization of the full scores matrix.
+        merged_df = genotype_df.set_index(samples_column).join(scores_df, how='inner')
+        if genes is None:
+            genes = scores_df.columns.tolist()
+        del scores_df
+    # the gene columns are already clean; only the covariates can still carry
+    # NaN/inf after the join.
+    if covariates:
+        merged_df[covariates] = np.nan_to_num(
+            merged_df[covariates].to_numpy(dtype=np.float64), nan=0.0, posinf=0.0, neginf=0.0)
     args = {
         'processes': processes, 'cases': cases, 'controls': controls, 'covariates': covariates,
     }
     logger.info("Calculating p_values using the following test: " + test)
     try:
-        p_values_df = association_functions.get(test)(df=merged_df, genes=genes, cases_column=cases_column, **args)
+        blocks = []
+        for start in range(0, len(genes), GENE_BLOCK_SIZE):
+            block_genes = genes[start:start + GENE_BLOCK_SIZE]
+            blocks.append(association_functions.get(test)(
+                df=merged_df, genes=block_genes, cases_column=cases_column, **args))
+        p_values_df = pd.concat(blocks, ignore_index=True).sort_values(by=['p_value'])
     except Exception as arg:
         logger.exception(arg)
         raise
     if adj_pval:
         logger.info("Calculating the adjusted p_values...")
-        adjusted = multipletests(list(p_values_df['p_value']), method=adj_pval)
-        p_values_df[adj_pval + '_adj_pval'] = list(adjusted)[1]
+        pvals = p_values_df['p_value'].to_numpy(dtype=np.float64)
+        if adj_pval == 'fdr_bh':
+            adjusted_pvals = _bh_adjust(pvals)
+        elif adj_pval == 'bonferroni':
+            adjusted_pvals = np.minimum(pvals * pvals.size, 1.0)
+        else:
+            adjusted_pvals = multipletests(pvals, method=adj_pval)[1]
+        p_values_df[adj_pval + '_adj_pval'] = adjusted_pvals
     p_values_df.to_csv(output_file, sep='\t', index=False)
     logger.info("Process is complete. The association analysis results have been saved.")
     return p_values_df
@@ -190,7 +265,7 @@ def betareg_pvalues(
     """
     logger.info("The p_values will be calculated using beta regression.")
     try:
-        p = subprocess.call(
+        p = subprocess.run(
             ["Rscript", BETAREG_SHELL,
              "-s", scores_file,
              "--phenofile", pheno_file,
@@ -200,6 +275,8 @@ def betareg_pvalues(
              "--covariates", covariates,
              "--processes", str(processes)]
         )
+        if p.returncode != 0:
+            raise RuntimeError('betareg exited with code %d' % p.returncode)
     except Exception as arg:
         logger.exception(arg)
         raise
@@ -218,6 +295,8 @@ def create_prediction_model(
     testing_set=pd.DataFrame(),
     test_size=0.25,
     metric=None,
+    plots=False,
+    session_id=None,
 ):
     """
     Create a prediction model (classifier or regressor) using the provided dataset.
@@ -233,8 +312,12 @@ def create_prediction_model(
     :param testing_set: if exists an extra evaluation step will be done using the testing set.
     :param test_size: the size to split the training/testing set.
     :param metric: the metric to evaluate the best model.
+    :param plots: if True, render and save the model evaluation plots.
+    :param session_id: the seed for the pycaret session. Defaults to the GENRISK_SEED environment variable.
     :return: the metrics.
     """
+    if session_id is None:
+        session_id = int(os.environ.get('GENRISK_SEED', '42'))
     try:
         model_func = {'classifier': classification_model, 'regressor': regression_model}
         final_model = model_func.get(model_type)(
@@ -247,6 +330,8 @@ def create_prediction_model(
             model_name=model_name,
             testing_set=testing_set,
             imbalanced=imbalanced,
+            plots=plots,
+            session_id=session_id,
         )
     except Exception:
         raise Exception('Model requested is not available. Please choose regressor or classifier.')
@@ -273,8 +358,12 @@ def model_testing(
 
     :return: a dataframe with prediction values.
     """
-    model = joblib.load(model_path)
-    testing_df = pd.read_csv(input_file, sep='\t', index_col=samples_col)
+    # mmap the pickled estimator arrays so large models page in on demand
+    model = joblib.load(model_path, mmap_mode='r')
+    if input_file.endswith('.parquet'):
+        testing_df = pd.read_parquet(input_file).set_index(samples_col)
+    else:
+        testing_df = read_table(input_file, index_col=samples_col)
     x_set = testing_df.drop(columns=label_col)
     model_func = {'classifier': test_classifier, 'regressor': test_regressor}
     unseen_predictions = model_func.get(model_type)(
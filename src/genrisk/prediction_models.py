@@ -1,4 +1,10 @@
-import random
+try:
+    # patches sklearn so the estimators pycaret trains run on GPU; purely
+    # optional (pip install --extra-index-url=https://pypi.nvidia.com cuml-cu12)
+    import cuml.accel
+    cuml.accel.install()
+except ImportError:
+    pass
 
 import pycaret.classification as pycl
 import pycaret.regression as pyreg
@@ -17,21 +23,24 @@ def regression_model(
     metric,
     model_name,
     testing_set,
-    imbalanced
+    imbalanced,
+    plots=False,
+    session_id=42
 ):
     if not metric:
         metric = 'RMSE'
     setup = pyreg.setup(target=y_col, data=training_set, normalize=normalize, train_size=1 - test_size,
-                        fold=folds, silent=True, session_id=random.randint(1, 2147483647))
+                        fold=folds, silent=True, session_id=session_id)
     best_model = pyreg.compare_models(sort=metric)
     pyreg.pull().to_csv(model_name + '_compare_models.tsv', sep='\t', index=False)
     reg_model = pyreg.create_model(best_model)
     reg_tuned_model = pyreg.tune_model(reg_model, optimize=metric)
     pyreg.pull().to_csv(model_name + '_tuned_model.tsv', sep='\t', index=False)
     final_model = pyreg.finalize_model(reg_tuned_model)
-    pyreg.plot_model(final_model, save=True)
-    pyreg.plot_model(final_model, plot='feature', save=True)
-    pyreg.plot_model(final_model, plot='error', save=True)
+    if plots:
+        pyreg.plot_model(final_model, save=True)
+        pyreg.plot_model(final_model, plot='feature', save=True)
+        pyreg.plot_model(final_model, plot='error', save=True)
     if len(testing_set.index) != 0:
         unseen_predictions = test_regressor(
             model=final_model, x_set=testing_set, y_col=testing_set[y_col], output=model_name
@@ -51,21 +60,24 @@ def classification_model(
     metric,
     model_name,
     testing_set,
-    imbalanced
+    imbalanced,
+    plots=False,
+    session_id=42
 ):
     if not metric:
         metric = 'AUC'
     setup = pycl.setup(target=y_col, fix_imbalance=imbalanced, normalize=normalize, data=training_set,
-                       train_size=1 - test_size, silent=True, fold=folds, session_id=random.randint(1, 2147483647))
+                       train_size=1 - test_size, silent=True, fold=folds, session_id=session_id)
     best_model = pycl.compare_models(sort=metric)
     pycl.pull().to_csv(model_name + '_compare_models.tsv', sep='\t', index=False)
     cl_model = pycl.create_model(best_model)
     cl_tuned_model = pycl.tune_model(cl_model, optimize=metric)
     pycl.pull().to_csv(model_name + '_tuned_model.tsv', sep='\t', index=False)
     final_model = pycl.finalize_model(cl_tuned_model)
-    pycl.plot_model(final_model, plot='pr', save=True)
-    pycl.plot_model(final_model, plot='confusion_matrix', save=True)
-    pycl.plot_model(final_model, plot='feature', save=True)
+    if plots:
+        pycl.plot_model(final_model, plot='pr', save=True)
+        pycl.plot_model(final_model, plot='confusion_matrix', save=True)
+        pycl.plot_model(final_model, plot='feature', save=True)
     if len(testing_set.index) != 0:
         unseen_predictions = test_classifier(
             model=final_model, x_set=testing_set, y_col=testing_set[y_col], output=model_name
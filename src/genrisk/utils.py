@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
 import matplotlib.pyplot as plt
 import numpy as np
-import pandas as pd
 import seaborn as sns
 from adjustText import adjust_text
 from pybiomart import Dataset
 from qmplot import qqplot
-from tqdm import tqdm
+
+from .helpers import read_scores_file, read_table
 
 
 def normalize_gene_len(
@@ -27,29 +27,25 @@ def normalize_gene_len(
     :return: a normalized dataframe.
     """
     if genes_lengths_file:
-        genes_df = pd.read_csv(genes_lengths_file, sep='\t')
+        genes_df = read_table(genes_lengths_file)
     else:
         gene_dataset = Dataset(name='hsapiens_gene_ensembl', host='http://www.ensembl.org')
         genes_df = gene_dataset.query(
             attributes=['external_gene_name', 'start_position', 'end_position'],
             only_unique=False,
         )
-    genes_lengths = {
-        row['Gene name']: round((row['Gene end (bp)'] - row['Gene start (bp)']) / 1000, 3)
-        for _, row in genes_df.iterrows()
-    }
-    scores_df = pd.read_csv(matrix_file, sep=r'\s+')
-    unnormalized = []
-    for (name, data) in tqdm(scores_df.iteritems(), desc="Normalizing genes scores"):
-        if name == samples_col:
-            continue
-        if name not in genes_lengths.keys():
-            unnormalized.append(name)
-            continue
-        # normalize genes by length
-        scores_df[name] = round(scores_df[name] / genes_lengths[name], 5)
+    genes_lengths = dict(zip(
+        genes_df['Gene name'],
+        ((genes_df['Gene end (bp)'] - genes_df['Gene start (bp)']) / 1000).round(3)))
+    scores_df = read_scores_file(matrix_file, samples_col=samples_col)
+    gene_cols = [name for name in scores_df.columns if name != samples_col]
+    normalized = [name for name in gene_cols if name in genes_lengths]
     # drop genes with unknown length
+    unnormalized = [name for name in gene_cols if name not in genes_lengths]
     scores_df = scores_df.drop(unnormalized, axis=1)
+    # normalize genes by length
+    lengths = np.array([genes_lengths[name] for name in normalized])
+    scores_df[normalized] = scores_df[normalized].div(lengths, axis=1).round(5)
     if output_path:
         scores_df.to_csv(output_path, sep='\t', index=False)
     return scores_df